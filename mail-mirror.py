@@ -8,27 +8,104 @@ A bot that queries an IMAP server and mirrors new mails to Zulip.
 Some functions are based on Zulip's mail handling code.
 https://github.com/zulip/zulip (Apache License 2.0)
 
-TODO: AsyncIO and IDLE using https://github.com/bamthomas/aioimaplib
+TODO: IMAP IDLE for push-driven mirroring
 
 :copyright: (c) 2018 by Florentin Putz.
 :license: EUPL-1.2+
 """
 
-from typing import Optional, Generator, Tuple
+from typing import Any, AsyncGenerator, Dict, FrozenSet, List, Optional, Tuple
 
 import bot_config
 
-import email
+import asyncio
+import concurrent.futures
 from email import policy
 from email.message import EmailMessage
 from email.header import decode_header
-from imaplib import IMAP4_SSL
+from email.parser import BytesHeaderParser, BytesParser
 import logging
 import re
+import textwrap
+import threading
+import time
+import aioimaplib  # type: ignore
 import html2text  # type: ignore
-import talon  # type: ignore
 import zulip  # type: ignore
 
+try:
+    # C-backed HTML parser; much faster than html2text's pure-Python one
+    from selectolax.parser import HTMLParser  # type: ignore
+except ImportError:
+    HTMLParser = None
+
+
+# Number of mails per batched BODYSTRUCTURE fetch
+FETCH_CHUNK_SIZE = 20
+
+# Number of mails to process (and send to Zulip) concurrently
+PROCESS_MAX_WORKERS = 8
+
+# Footer keywords as a frozenset, so filtering a section is a C-level
+# set intersection instead of a Python loop per keyword
+_FOOTER_KEYWORDS = frozenset(bot_config.FOOTER_FILTER_KEYWORDS)
+
+# HTML2Text.handle() mutates parser state on the instance, so the
+# converter cannot be shared between worker threads; each thread keeps
+# its own instead of constructing one per mail
+_h2t_local = threading.local()
+
+
+def _get_h2t() -> html2text.HTML2Text:
+    """Returns this thread's HTML-to-Markdown converter.
+
+    Returns:
+        The converter, created on first use per thread.
+    """
+    h2t = getattr(_h2t_local, 'h2t', None)
+    if h2t is None:
+        h2t = html2text.HTML2Text()
+        h2t.body_width = 0
+        h2t.emphasis_mark = "*"
+        _h2t_local.h2t = h2t
+    return h2t
+
+# Compiled subject-prefix matchers, keyed by the prefix tuple; see
+# remove_subject_prefixes()
+_prefix_re_cache: Dict[Tuple[str, ...], "re.Pattern[str]"] = {}
+
+# Two-stage mail parsing: headers are cheap to parse on their own, the
+# full MIME parse only runs on the bytes that need it
+_HEADER_PARSER = BytesHeaderParser(policy=policy.default)
+_FULL_PARSER = BytesParser(policy=policy.default)
+
+# Lazily imported and initialized talon module, see _init_talon()
+_talon = None
+_talon_lock = threading.Lock()
+
+# Guards the topic cache in get_zulip_topics_set(), which is shared by
+# the processing workers
+_topics_cache_lock = threading.Lock()
+
+
+def _init_talon() -> Any:
+    """Imports and initializes talon on first use.
+
+    talon.init() loads ML models and compiles many regexes, so the cost
+    is only paid once a mail actually needs quotation removal. Guarded
+    by a lock since mails are processed from worker threads.
+
+    Returns:
+        The initialized talon module.
+    """
+    global _talon
+    with _talon_lock:
+        if _talon is None:
+            import talon  # type: ignore
+            talon.init()
+            _talon = talon
+    return _talon
+
 
 class EmailMirrorError(Exception):
     """Custom exception for mail mirroring errors."""
@@ -49,50 +126,73 @@ def remove_subject_prefixes(subject: str, prefixes: Tuple[str, ...]) -> str:
     >>> remove_subject_prefixes("Re: Fwd: Test", ("Fwd:", "Re:"))
     "Test"
     """
-    def remove_prefixes_once(text: str) -> str:
-        for prefix in prefixes:
-            if text.lower().startswith(prefix.lower()):
-                return text[len(prefix):].lstrip()
-        return text
+    if not prefixes:
+        return subject
 
-    while any(subject.lower().startswith(prefix.lower()) for prefix in prefixes):
-        subject = remove_prefixes_once(subject)
+    try:
+        prefix_re = _prefix_re_cache[prefixes]
+    except KeyError:
+        # One anchored alternation does the work of P case-insensitive
+        # startswith tests per iteration, compiled once per prefix tuple
+        prefix_re = _prefix_re_cache[prefixes] = re.compile(
+            r'^(?:' + '|'.join(re.escape(p) for p in prefixes) + r')\s*',
+            re.IGNORECASE)
+
+    while True:
+        subject, n = prefix_re.subn('', subject, count=1)
+        if not n:
+            break
 
     return subject
 
 
-def get_zulip_topics_by_stream(client: zulip.Client,
-                               stream: str) -> Generator[str, None, None]:
-    """Yields all topic names in the given Zulip stream.
+def get_zulip_topics_set(client: zulip.Client,
+                         stream: str,
+                         cache: Dict[str, Any],
+                         ttl: float = 60.0) -> FrozenSet[str]:
+    """Returns all topic names in the given Zulip stream.
+
+    Re-queries Zulip only when the cached set is older than `ttl`
+    seconds, so a whole batch of mails triggers at most one lookup. A
+    lock serializes the refresh, since the cache is shared by the
+    processing workers.
 
     Args:
         client: The Zulip client instance.
         stream: The name of the Zulip stream.
+        cache: Cache dict with keys "at" (monotonic timestamp) and "set".
+        ttl: How long a cached topic set stays valid, in seconds.
 
-    Yields:
+    Returns:
         The topic names in the stream.
     """
-    # Get the stream id for the zulip stream
-    response = client.get_stream_id(stream)
-    stream_id = response["stream_id"]
-    # Get topic for this stream id
-    response = client.get_stream_topics(stream_id)
-    for topic in response['topics']:
-        yield topic['name']
-
-
-def process_message(message: EmailMessage) -> None:
+    with _topics_cache_lock:
+        if not cache["at"] or time.monotonic() - cache["at"] > ttl:
+            # Get the stream id for the zulip stream
+            response = client.get_stream_id(stream)
+            stream_id = response["stream_id"]
+            # Get topics for this stream id
+            response = client.get_stream_topics(stream_id)
+            cache["set"] = frozenset(
+                topic['name'] for topic in response['topics'])
+            cache["at"] = time.monotonic()
+        return cache["set"]
+
+
+def process_message(message: EmailMessage,
+                    client: zulip.Client,
+                    topics_cache: Dict[str, Any]) -> None:
     """Mirrors an incoming mail to Zulip.
 
     Args:
         message: The mail to mirror.
+        client: The Zulip client instance.
+        topics_cache: Cache for the stream's topic set, shared per run.
 
     Raises:
         EmailMirrorError: If the message could not be sent to Zulip.
     """
     subject = extract_email_subject(message)
-    client = zulip.Client(config_file=bot_config.ZULIPRC)
-
 
     # Extract the mail's subject
     # --------------------------
@@ -101,18 +201,16 @@ def process_message(message: EmailMessage) -> None:
 
     # Don't remove quotations by default.
     # If this is a reply to an already mirrored message, skip all quotations
-    remove_quotations = subject in get_zulip_topics_by_stream(client, bot_config.ZULIP_STREAM)
+    remove_quotations = subject in get_zulip_topics_set(
+        client, bot_config.ZULIP_STREAM, topics_cache)
 
     # Extract the mail's body
     # -----------------------
     body = extract_email_body(message, remove_quotations)
-    # Remove null characters, since Zulip will reject
-    body = body.replace("\x00", "")
-    body = filter_footers(body).strip() or '(No email body)'
 
     # Format the message for Zulip
     # ----------------------------
-    body = quote_each_line(body)
+    body = quote_and_sanitize(filter_footers(body))
     body = bot_config.ZULIP_MESSAGE_FORMAT.format(sender=message["From"], body=body)
 
     zulip_message = {
@@ -124,8 +222,8 @@ def process_message(message: EmailMessage) -> None:
 
     logging.debug("\n")
     logging.debug("\n")
-    logging.debug(f"Mirroring mail with subject: {subject}")
-    logging.debug(f"... Body:\n {body}")
+    logging.debug("Mirroring mail with subject: %s", subject)
+    logging.debug("... Body:\n %s", body)
     logging.debug("\n")
     response = client.send_message(zulip_message)
 
@@ -133,8 +231,7 @@ def process_message(message: EmailMessage) -> None:
         raise EmailMirrorError("Failed to send message to Zulip."
                                f"{response['code']}: {response['msg']}")
     else:
-        logging.info("Successfully mirrored mail with subject:"
-                     f"{subject}")
+        logging.info("Successfully mirrored mail with subject: %s", subject)
         logging.debug("\n")
 
 
@@ -172,8 +269,10 @@ def extract_email_body(message: EmailMessage,
     Returns:
         The cleaned and formatted mail body.
     """
-    plaintext_content = get_message_part_by_type(message, "text/plain")
-    html_content = get_message_part_by_type(message, "text/html")
+    plaintext_content, html_content = get_text_parts(message)
+
+    if remove_quotations:
+        talon = _init_talon()
 
     if plaintext_content:
         # If the message contains a plaintext version of the body, use
@@ -191,11 +290,14 @@ def extract_email_body(message: EmailMessage,
         if remove_quotations:
             html_content = talon.quotations.extract_from_html(html_content)
 
-        # Convert HTML to Markdown
-        h = html2text.HTML2Text()
-        h.body_width = 0
-        h.emphasis_mark = "*"
-        return h.handle(html_content)
+        # Convert HTML to text
+        if HTMLParser is not None:
+            tree = HTMLParser(html_content)
+            return tree.body.text(separator='\n') if tree.body else ''
+
+        # Fallback: html2text also emits Markdown emphasis marks, but
+        # parses and formats in pure Python
+        return _get_h2t().handle(html_content)
 
     #raise EmailMirrorError(f"Unable to find E-Mail body: {message}")
     return ''
@@ -210,90 +312,374 @@ def filter_footers(text: str) -> str:
     Returns:
         The mail body without footers.
     """
-    # Split the text into sections separated by "--..." or "__..." lines
-    sections = re.split(r'\n--.*\n|\n__.*\n', text)
+    # Split the text into sections separated by "--..." or "__..." lines.
+    # A single line-by-line pass is already deterministic and linear, so
+    # no regex engine (and no possessive/atomic quantifiers to guard
+    # against backtracking) is needed here at all.
+    current: List[str] = []
+    sections = [current]
+    for line in text.splitlines():
+        if line.startswith(('--', '__')):
+            current = []
+            sections.append(current)
+        else:
+            current.append(line)
 
     if len(sections) in (1,2):
         # Only body, or exactly one footer? -> just return the body
-        return sections[0].strip()
+        return "\n".join(sections[0]).strip()
 
     useful_sections = [
-        section for section in sections
-        if not any(keyword in section.splitlines() for keyword in bot_config.FOOTER_FILTER_KEYWORDS)
+        "\n".join(section) for section in sections
+        if not (_FOOTER_KEYWORDS & set(section))
     ]
 
     return "\n".join(useful_sections).strip()
 
 
-def quote_each_line(text: str) -> str:
-    """Quotes each line of the given text.
+def quote_and_sanitize(text: str) -> str:
+    """Quotes each line of the given text and strips null characters.
+
+    Null characters are removed since Zulip will reject them.
+    textwrap.indent streams over the text in a single pass, instead of
+    materializing a list of prefixed lines before joining them.
 
     Args:
         text: The text to quote.
 
     Returns:
-        The quoted text.
+        The quoted text, or a quoted placeholder if the text is empty.
     """
-    lines = [f"> {line}" for line in text.splitlines()]
-    return "\n".join(lines)
+    quoted = textwrap.indent(text.replace("\x00", ""), "> ",
+                             lambda line: True)
+    return quoted or "> (No email body)"
 
 
-def get_imap_messages(
-        delete_afterwards: bool = False
-) -> Generator[EmailMessage, None, None]:
-    """Yields all new mails.
+def _parse_paren_list(data: bytes) -> List[Any]:
+    """Parses an IMAP parenthesized list into nested Python lists.
 
-    Based on:
-    https://github.com/zulip/zulip/blob/a2a695dfa7a3fbd9d406dcce9c6299e41c6a445d/zerver/management/commands/email_mirror.py
+    Quoted strings become `str`, NIL becomes None, other atoms stay as
+    `str`. Raises ValueError on malformed input.
 
     Args:
-        delete_afterwards: Whether to delete the mails after processing.
+        data: The raw list, starting at an opening parenthesis.
+
+    Returns:
+        The nested list structure.
+    """
+    stack: List[List[Any]] = [[]]
+    i = 0
+    while i < len(data):
+        c = data[i:i + 1]
+        if c == b'(':
+            stack.append([])
+            i += 1
+        elif c == b')':
+            done = stack.pop()
+            if not stack:
+                raise ValueError("Unbalanced parenthesis")
+            stack[-1].append(done)
+            if len(stack) == 1:
+                return stack[0][0]
+            i += 1
+        elif c == b'"':
+            end = i + 1
+            while end < len(data) and data[end:end + 1] != b'"':
+                end += 2 if data[end:end + 1] == b'\\' else 1
+            if end >= len(data):
+                raise ValueError("Unterminated quoted string")
+            stack[-1].append(data[i + 1:end].decode('utf-8', 'replace'))
+            i = end + 1
+        elif c.isspace():
+            i += 1
+        else:
+            end = i
+            while end < len(data) and data[end:end + 1] not in b'() "':
+                end += 1
+            atom = data[i:end].decode('utf-8', 'replace')
+            stack[-1].append(None if atom.upper() == 'NIL' else atom)
+            i = end
+    raise ValueError("Unterminated list")
+
+
+def _find_text_sections(bodystructure: List[Any],
+                        prefix: str = "") -> List[str]:
+    """Finds the IMAP section numbers of all text/* parts.
+
+    Args:
+        bodystructure: A parsed BODYSTRUCTURE list.
+        prefix: Section number prefix for nested multiparts.
+
+    Returns:
+        The section numbers (e.g. ["1", "2.1"]) of the text parts.
+    """
+    sections = []
+    if bodystructure and isinstance(bodystructure[0], list):
+        # Multipart: the child parts come first, then the subtype
+        children = (p for p in bodystructure if isinstance(p, list))
+        for idx, child in enumerate(children, start=1):
+            sections.extend(_find_text_sections(child, f"{prefix}{idx}."))
+    elif (len(bodystructure) >= 2
+            and isinstance(bodystructure[0], str)
+            and bodystructure[0].lower() == "text"):
+        sections.append(prefix[:-1] if prefix else "1")
+    return sections
+
+
+def _collect_fetch_sections(lines: List[Any]) -> Dict[str, bytes]:
+    """Maps BODY[...] section names to their literal data in a FETCH response.
+
+    Args:
+        lines: The response lines from aioimaplib.
+
+    Returns:
+        A dict from section name (e.g. "HEADER", "1.MIME") to raw bytes.
+    """
+    sections: Dict[str, bytes] = {}
+    pending = None
+    for line in lines:
+        if isinstance(line, bytearray):
+            if pending is not None:
+                sections[pending] = bytes(line)
+                pending = None
+        else:
+            match = re.search(rb'BODY\[([^\]]*)\]', line)
+            if match:
+                pending = match.group(1).decode()
+    return sections
+
+
+def _parse_bodystructures(lines: List[Any]) -> Dict[str, bytes]:
+    """Maps UIDs to their raw BODYSTRUCTURE lists in a batched FETCH response.
+
+    Args:
+        lines: The response lines from aioimaplib.
+
+    Returns:
+        A dict from UID to the raw parenthesized BODYSTRUCTURE bytes.
+    """
+    structures: Dict[str, bytes] = {}
+    for line in lines:
+        if isinstance(line, (bytes, bytearray)):
+            uid_match = re.search(rb'UID (\d+)', bytes(line))
+            bs_match = re.search(rb'BODYSTRUCTURE\s+(\(.*)', bytes(line),
+                                 re.DOTALL)
+            if uid_match and bs_match:
+                structures[uid_match.group(1).decode()] = bs_match.group(1)
+    return structures
+
+
+async def _fetch_message(mb: aioimaplib.IMAP4_SSL, uid: str,
+                         raw_structure: Optional[bytes] = None
+                         ) -> EmailMessage:
+    """Fetches one mail, downloading only its header and text parts.
+
+    Uses BODYSTRUCTURE to locate the text/* sections and fetches just
+    those with BODY.PEEK, so multi-MB attachments are never downloaded.
+    Falls back to the full message if the structure cannot be parsed.
+
+    Args:
+        mb: The selected IMAP connection.
+        uid: The UID of the mail to fetch.
+        raw_structure: The raw BODYSTRUCTURE bytes from a batched FETCH,
+            if already available.
+
+    Returns:
+        The parsed mail.
+    """
+    try:
+        if raw_structure is None:
+            response = await mb.uid('fetch', uid, '(BODYSTRUCTURE)')
+            match = re.search(rb'BODYSTRUCTURE\s+(\(.*)', response.lines[0],
+                              re.DOTALL)
+            if not match:
+                raise ValueError("No BODYSTRUCTURE in response")
+            raw_structure = match.group(1)
+        bodystructure = _parse_paren_list(raw_structure)
+        text_sections = _find_text_sections(bodystructure)
+        if not text_sections:
+            raise ValueError("No text sections found")
+
+        fields = ' '.join(f'BODY.PEEK[{s}.MIME] BODY.PEEK[{s}]'
+                          for s in text_sections)
+        response = await mb.uid('fetch', uid,
+                                f'(BODY.PEEK[HEADER] {fields})')
+        data = _collect_fetch_sections(response.lines)
+        header_bytes = data['HEADER']
+
+        msg: EmailMessage = _HEADER_PARSER.parsebytes(  # type: ignore
+            header_bytes)
+        if msg.get_content_maintype() == 'multipart':
+            msg.set_payload([
+                _FULL_PARSER.parsebytes(data[f'{s}.MIME'] + data[s])
+                for s in text_sections])
+        else:
+            msg = _FULL_PARSER.parsebytes(  # type: ignore
+                header_bytes + data[text_sections[0]])
+        return msg
+    except (ValueError, KeyError, IndexError):
+        # Server response we cannot handle; fetch the whole message
+        response = await mb.uid('fetch', uid, '(BODY.PEEK[])')
+        return _FULL_PARSER.parsebytes(  # type: ignore
+            bytes(response.lines[1]))
+
+
+async def get_imap_messages(
+) -> AsyncGenerator[Tuple[str, EmailMessage], None]:
+    """Yields all new mails together with their UIDs.
+
+    Only mails not yet marked as read are fetched. The body structures
+    of a whole chunk are fetched with one batched command, and only the
+    header and text parts of each mail are downloaded. BODY.PEEK leaves
+    the mails unread; flagging them is left to mark_mails_processed()
+    so only successfully mirrored mails lose their unread state.
+
+    Based on:
+    https://github.com/zulip/zulip/blob/a2a695dfa7a3fbd9d406dcce9c6299e41c6a445d/zerver/management/commands/email_mirror.py
 
     Yields:
-        The new mails.
+        (uid, mail) tuples for the new mails.
     """
-    mb = IMAP4_SSL(bot_config.IMAP_SERVER)
-    mb.login(bot_config.IMAP_USER, bot_config.IMAP_PASSWORD)
+    mb = aioimaplib.IMAP4_SSL(bot_config.IMAP_SERVER)
+    await mb.wait_hello_from_server()
+    await mb.login(bot_config.IMAP_USER, bot_config.IMAP_PASSWORD)
     try:
-        mb.select()
+        await mb.select()
         try:
-            _, msg_ids = mb.search(None, 'ALL')
-            for msg_id in msg_ids[0].split():
-                _, msg_data = mb.fetch(msg_id, '(RFC822)')
-                msg_as_bytes = msg_data[0][1]
-                msg: EmailMessage = email.message_from_bytes(  # type: ignore
-                    msg_as_bytes, policy=policy.default)
-                yield msg
-                if delete_afterwards:
-                    mb.store(msg_id, '+FLAGS', '\\Deleted')
-            mb.expunge()
+            _, data = await mb.uid_search('UNSEEN')
+            msg_uids = [uid.decode() for uid in data[0].split()]
+            for start in range(0, len(msg_uids), FETCH_CHUNK_SIZE):
+                chunk = msg_uids[start:start + FETCH_CHUNK_SIZE]
+                # One batched FETCH for the whole chunk's body structures
+                response = await mb.uid('fetch', ','.join(chunk),
+                                        '(BODYSTRUCTURE)')
+                structures = _parse_bodystructures(response.lines)
+                # aioimaplib tracks only one pending command per command
+                # name, so concurrent FETCHes on one connection corrupt
+                # the responses; the section fetches run one at a time
+                for uid in chunk:
+                    yield uid, await _fetch_message(mb, uid,
+                                                    structures.get(uid))
         finally:
-            mb.close()
+            await mb.close()
     finally:
-        mb.logout()
+        await mb.logout()
+
 
+async def mark_mails_processed(uids: List[str],
+                               delete: bool = False) -> None:
+    """Marks the given mails as read, or deletes them.
 
-def get_message_part_by_type(message: EmailMessage,
-                             content_type: str) -> Optional[str]:
-    """Gets a specific part of the mail by content type.
+    Runs after processing on its own connection, so mails whose mirror
+    attempt failed keep their unread state and are retried on the next
+    run.
 
     Args:
-        message: The mail message.
-        content_type: The desired content type (e.g., "text/plain", "text/html").
+        uids: The UIDs of the successfully mirrored mails.
+        delete: Whether to delete the mails instead of flagging them.
+    """
+    if not uids:
+        return
+    mb = aioimaplib.IMAP4_SSL(bot_config.IMAP_SERVER)
+    await mb.wait_hello_from_server()
+    await mb.login(bot_config.IMAP_USER, bot_config.IMAP_PASSWORD)
+    try:
+        await mb.select()
+        try:
+            if delete:
+                await mb.uid('store', ','.join(uids), '+FLAGS',
+                             '\\Deleted')
+                await mb.expunge()
+            else:
+                await mb.uid('store', ','.join(uids), '+FLAGS',
+                             '\\Seen')
+        finally:
+            await mb.close()
+    finally:
+        await mb.logout()
+
+
+def _decode_part(part: EmailMessage) -> Optional[str]:
+    """Decodes the payload of a single mail part.
+
+    With policy.default, get_content() already returns a str with the
+    part's charset handled.
+
+    Args:
+        part: The mail part.
 
     Returns:
-        The content of the desired type, if found.
+        The decoded content, or None if it cannot be decoded.
     """
-    # Source: Zulip's mail handling code
-    charsets = message.get_charsets()
+    try:
+        return part.get_content()
+    except (UnicodeDecodeError, LookupError):
+        content = part.get_payload(decode=True)
+        if isinstance(content, bytes):
+            return content.decode('utf-8', errors='ignore')
+        return None
 
-    for idx, part in enumerate(message.walk()):
-        if part.get_content_type() == content_type:
-            content = part.get_payload(decode=True)
-            assert isinstance(content, bytes)
-            if charsets[idx]:
-                return content.decode(charsets[idx], errors="ignore")
-    return None
+
+def get_text_parts(
+        message: EmailMessage) -> Tuple[Optional[str], Optional[str]]:
+    """Gets the text/plain and text/html parts of the mail in one walk.
+
+    Args:
+        message: The mail message.
+
+    Returns:
+        A (plaintext_content, html_content) tuple; each may be None.
+    """
+    plaintext_content = html_content = None
+
+    for part in message.walk():
+        content_type = part.get_content_type()
+        if content_type == "text/plain" and plaintext_content is None:
+            plaintext_content = _decode_part(part)
+        elif content_type == "text/html" and html_content is None:
+            html_content = _decode_part(part)
+        if plaintext_content is not None and html_content is not None:
+            break
+    return plaintext_content, html_content
+
+
+async def run() -> None:
+    """Processes and mirrors all new mails to Zulip.
+
+    Each mail mostly waits on the Zulip HTTP round-trip, so messages are
+    processed in a thread pool while the IMAP fetches continue. The
+    shared zulip.Client is backed by a thread-safe requests.Session, so
+    the workers also share its connection pool.
+    """
+    client = zulip.Client(config_file=bot_config.ZULIPRC)
+    topics_cache: Dict[str, Any] = {"at": 0.0, "set": frozenset()}
+    loop = asyncio.get_running_loop()
+    uids = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=PROCESS_MAX_WORKERS) as executor:
+        tasks = []
+        async for uid, message in get_imap_messages():
+            uids.append(uid)
+            tasks.append(loop.run_in_executor(
+                executor, process_message, message, client, topics_cache))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    processed_uids = []
+    unexpected = None
+    for uid, result in zip(uids, results):
+        if isinstance(result, EmailMirrorError):
+            logging.error("Error while processing incoming E-Mail: %s",
+                          result)
+        elif isinstance(result, Exception):
+            unexpected = unexpected or result
+        else:
+            processed_uids.append(uid)
+
+    # Flag (or delete) only the mails that were actually mirrored
+    await mark_mails_processed(processed_uids,
+                               bot_config.REMOVE_MIRRORED_MAILS)
+    if unexpected is not None:
+        raise unexpected
 
 
 def main() -> None:
@@ -306,14 +692,8 @@ def main() -> None:
     logging.basicConfig(**log_config)  # type: ignore
     logging.getLogger("zulip").setLevel(logging.WARNING)
 
-    talon.init()
-
     try:
-        for message in get_imap_messages(bot_config.REMOVE_MIRRORED_MAILS):
-            try:
-                process_message(message)
-            except EmailMirrorError as e:
-                logging.error(f"Error while processing incoming E-Mail: {str(e)}")
+        asyncio.run(run())
     except KeyboardInterrupt:
         print("Exiting... (keyboard interrupt)")
 